@@ -0,0 +1,157 @@
+import asyncio
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+
+import metrics
+
+
+# ------------------ Config ------------------
+ADMIT_MAX_CONCURRENT = int(os.getenv("ADMIT_MAX_CONCURRENT", "8"))       # chat turns running at once
+ADMIT_MAX_QUEUE = int(os.getenv("ADMIT_MAX_QUEUE", "16"))                # turns allowed to wait for a slot
+ADMIT_QUEUE_TIMEOUT = float(os.getenv("ADMIT_QUEUE_TIMEOUT", "10"))      # seconds a turn may wait
+ADMIT_USER_CONCURRENT = int(os.getenv("ADMIT_USER_CONCURRENT", "2"))     # running + queued turns per user
+ADMIT_USER_RATE = float(os.getenv("ADMIT_USER_RATE", "0.5"))             # turns per second per user
+ADMIT_USER_BURST = float(os.getenv("ADMIT_USER_BURST", "5"))
+ADMIT_GLOBAL_RATE = float(os.getenv("ADMIT_GLOBAL_RATE", "5"))           # turns per second, all users
+ADMIT_GLOBAL_BURST = float(os.getenv("ADMIT_GLOBAL_BURST", "20"))
+
+
+class AdmissionRejected(Exception):
+    """Turn was shed; carries the HTTP status and Retry-After to send back."""
+
+    def __init__(self, status_code, detail, retry_after):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+# ------------------ Admission Controller ------------------
+class AdmissionController:
+    """Per-user and global token-bucket rate limits, a per-user concurrency
+    cap, and a global concurrency limit with a bounded, deadline-aware
+    wait queue. Rate tokens are only kept by turns that get admitted.
+
+    Everything runs on the event loop, so plain dicts/ints need no locking.
+    """
+
+    def __init__(self, max_concurrent=ADMIT_MAX_CONCURRENT, max_queue=ADMIT_MAX_QUEUE,
+                 queue_timeout=ADMIT_QUEUE_TIMEOUT, user_concurrent=ADMIT_USER_CONCURRENT,
+                 user_rate=ADMIT_USER_RATE, user_burst=ADMIT_USER_BURST,
+                 global_rate=ADMIT_GLOBAL_RATE, global_burst=ADMIT_GLOBAL_BURST):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.user_concurrent = user_concurrent
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.global_rate = global_rate
+        self.global_burst = global_burst
+
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._running = 0
+        self._waiting = 0
+        self._per_user = {}
+        self._buckets = {}   # user_id -> (tokens, last refill time)
+        self._global_bucket = (global_burst, time.monotonic())
+        self._publish()
+
+    def _publish(self):
+        metrics.set_gauge("admission_running", self._running)
+        metrics.set_gauge("admission_queue_depth", self._waiting)
+
+    def _reject(self, reason, status_code, detail, retry_after):
+        metrics.incr(f"admission_rejected_total:{reason}")
+        raise AdmissionRejected(status_code, detail, retry_after)
+
+    @staticmethod
+    def _refill(bucket, rate, burst, now):
+        tokens, last = bucket if bucket else (burst, now)
+        return min(burst, tokens + (now - last) * rate)
+
+    def _take_token(self, user_id):
+        now = time.monotonic()
+        user_tokens = self._refill(self._buckets.get(user_id), self.user_rate, self.user_burst, now)
+        global_tokens = self._refill(self._global_bucket, self.global_rate, self.global_burst, now)
+        self._buckets[user_id] = (user_tokens, now)
+        self._global_bucket = (global_tokens, now)
+
+        if user_tokens < 1:
+            self._reject("user_rate", 429, "Too many messages, slow down",
+                         (1 - user_tokens) / self.user_rate)
+        if global_tokens < 1:
+            self._reject("global_rate", 503, "Server busy, try again shortly",
+                         (1 - global_tokens) / self.global_rate)
+
+        self._buckets[user_id] = (user_tokens - 1, now)
+        self._global_bucket = (global_tokens - 1, now)
+
+        # Full buckets carry no information; drop them so the dict stays small
+        if len(self._buckets) > 10000:
+            self._buckets = {
+                u: (t, ts) for u, (t, ts) in self._buckets.items()
+                if t + (now - ts) * self.user_rate < self.user_burst
+            }
+
+    def _refund_token(self, user_id):
+        """Give back the rate tokens of a turn that was shed after all, so a
+        client honouring Retry-After is not also rate limited for it."""
+        now = time.monotonic()
+        user_tokens = self._refill(self._buckets.get(user_id), self.user_rate, self.user_burst, now)
+        global_tokens = self._refill(self._global_bucket, self.global_rate, self.global_burst, now)
+        self._buckets[user_id] = (min(self.user_burst, user_tokens + 1), now)
+        self._global_bucket = (min(self.global_burst, global_tokens + 1), now)
+
+    async def _wait_for_slot(self):
+        self._waiting += 1
+        self._publish()
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._reject("queue_timeout", 503, "Server busy, try again shortly", self.queue_timeout)
+        finally:
+            self._waiting -= 1
+            metrics.observe("admission_wait_seconds", time.monotonic() - start)
+
+    @asynccontextmanager
+    async def admit(self, user_id):
+        """Hold a slot for one chat turn or raise AdmissionRejected."""
+        # Cheap rejections first, before any rate token is spent
+        if self._per_user.get(user_id, 0) >= self.user_concurrent:
+            self._reject("user_concurrency", 429, "Another message is still being answered", 1)
+
+        if self._slots.locked() and self._waiting >= self.max_queue:
+            self._reject("queue_full", 503, "Server busy, try again shortly", self.queue_timeout)
+
+        self._take_token(user_id)
+
+        self._per_user[user_id] = self._per_user.get(user_id, 0) + 1
+        try:
+            if self._slots.locked():
+                try:
+                    await self._wait_for_slot()
+                except AdmissionRejected:
+                    self._refund_token(user_id)
+                    raise
+            else:
+                await self._slots.acquire()   # free slot: returns without suspending
+
+            self._running += 1
+            self._publish()
+            metrics.incr("admission_admitted_total")
+            try:
+                yield
+            finally:
+                self._running -= 1
+                self._slots.release()
+        finally:
+            self._per_user[user_id] -= 1
+            if not self._per_user[user_id]:
+                del self._per_user[user_id]
+            self._publish()
+
+
+chat_admission = AdmissionController()
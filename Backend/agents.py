@@ -1,15 +1,12 @@
-import google.generativeai as genai
 from datetime import datetime
-import os
 from database import get_db_conn
-
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+from llm_client import DEFAULT_MODEL, get_model_client
 
 
 # ------------------ Context Agent ------------------
 class ContextManagerAgent:
-    def __init__(self, model="gemini-2.0-flash"):
-        self.model = genai.GenerativeModel(model)
+    def __init__(self, model=DEFAULT_MODEL):
+        self.model = get_model_client(model)
 
     def build_context(self, history):
         text = "\n".join([f"{h['sender']}: {h['message']}" for h in history])
@@ -27,10 +24,10 @@ class ContextManagerAgent:
 
 # ------------------ Character Agent ------------------
 class CharacterAgent:
-    def __init__(self, character_name, tone="friendly", model="gemini-2.0-flash"):
+    def __init__(self, character_name, tone="friendly", model=DEFAULT_MODEL):
         self.character_name = character_name
         self.tone = tone
-        self.model = genai.GenerativeModel(model)
+        self.model = get_model_client(model)
 
     def reply(self, context_summary, user_msg):
         prompt = f"""
@@ -53,8 +50,8 @@ class CharacterAgent:
 
 # ------------------ Moderator Agent ------------------
 class ModeratorAgent:
-    def __init__(self, model="gemini-2.0-flash"):
-        self.model = genai.GenerativeModel(model)
+    def __init__(self, model=DEFAULT_MODEL):
+        self.model = get_model_client(model)
 
     def check(self, reply):
         prompt = f"""
@@ -70,21 +67,38 @@ class ModeratorAgent:
 
 
 # ------------------ Helpers ------------------
+def fetch_persona_api(persona_id, user_id):
+    """Persona row if it belongs to this user, else None."""
+    conn = get_db_conn()
+    cursor = conn.cursor(dictionary=True)
+
+    try:
+        cursor.execute("SELECT * FROM persona_flow WHERE id=%s AND user_id=%s",
+                       (persona_id, user_id))
+        persona = cursor.fetchone()
+    finally:
+        cursor.close()
+        conn.close()
+
+    return persona
+
+
 def fetch_last_messages_api(persona_id, limit=10):
     limit = max(3, min(limit, 30))  # safety
 
     conn = get_db_conn()
     cursor = conn.cursor(dictionary=True)
 
-    cursor.execute("""
-        SELECT sender, message FROM persona_messages
-        WHERE persona_id=%s ORDER BY id DESC LIMIT %s
-    """, (persona_id, limit))
-
-    rows = cursor.fetchall()
+    try:
+        cursor.execute("""
+            SELECT sender, message FROM persona_messages
+            WHERE persona_id=%s ORDER BY id DESC LIMIT %s
+        """, (persona_id, limit))
 
-    cursor.close()
-    conn.close()
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+        conn.close()
 
     return list(reversed(rows))
 
@@ -93,14 +107,23 @@ def save_message_api(persona_id, sender, message):
     conn = get_db_conn()
     cursor = conn.cursor()
 
-    cursor.execute("""
-        INSERT INTO persona_messages (persona_id, sender, message, created_at)
-        VALUES (%s, %s, %s, NOW())
-    """, (persona_id, sender, message))
+    try:
+        cursor.execute("""
+            INSERT INTO persona_messages (persona_id, sender, message, created_at)
+            VALUES (%s, %s, %s, NOW())
+        """, (persona_id, sender, message))
+
+        conn.commit()
+        message_id = cursor.lastrowid
+    finally:
+        cursor.close()
+        conn.close()
+
+    return message_id
+
 
-    conn.commit()
-    cursor.close()
-    conn.close()
+class PipelineCancelled(Exception):
+    """The caller went away; remaining agent steps were skipped."""
 
 
 class MultiAgentPipeline:
@@ -109,8 +132,19 @@ class MultiAgentPipeline:
         self.char = CharacterAgent(character_name, tone)
         self.mod = ModeratorAgent()
 
-    def run(self, persona_id, user_msg):
-        history = fetch_last_messages_api(persona_id)
+    def run(self, persona_id, user_msg, cancel_event=None, history=None):
+        # cancel_event (threading.Event) is checked between model calls so a
+        # disconnected client does not keep paying for the rest of the turn
+        def checkpoint():
+            if cancel_event is not None and cancel_event.is_set():
+                raise PipelineCancelled()
+
+        # Long-lived callers (websocket sessions) pass the history they keep in memory
+        if history is None:
+            history = fetch_last_messages_api(persona_id)
+        checkpoint()
         ctx = self.ctx.build_context(history)
+        checkpoint()
         raw = self.char.reply(ctx, user_msg)
+        checkpoint()
         return self.mod.check(raw)
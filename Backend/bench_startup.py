@@ -0,0 +1,101 @@
+"""Startup benchmark for the backend.
+
+Measures, over several fresh processes:
+  - import time of `main` (what every worker pays before it can serve)
+  - time from spawning uvicorn to the first request served (/health/live)
+  - time until /health/ready reports ready (includes warm-up)
+
+Usage (from the Backend directory):
+    python bench_startup.py --runs 5
+    python bench_startup.py --runs 5 --no-warmup
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+IMPORT_SNIPPET = (
+    "import time; t = time.perf_counter(); import main; "
+    "print(time.perf_counter() - t)"
+)
+
+
+def measure_import():
+    out = subprocess.run(
+        [sys.executable, "-c", IMPORT_SNIPPET],
+        cwd=HERE, capture_output=True, text=True, check=True,
+    )
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def wait_for(url, ok_statuses, deadline):
+    while time.perf_counter() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as r:
+                if r.status in ok_statuses:
+                    return True
+        except urllib.error.HTTPError as e:
+            if e.code in ok_statuses:
+                return True
+        except (urllib.error.URLError, ConnectionError, OSError):
+            pass
+        time.sleep(0.02)
+    return False
+
+
+def measure_server(port, warmup, timeout):
+    env = dict(os.environ, WARMUP_ON_STARTUP="true" if warmup else "false")
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=HERE, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        deadline = start + timeout
+        base = f"http://127.0.0.1:{port}"
+        first = time.perf_counter() - start if wait_for(f"{base}/health/live", {200}, deadline) else None
+        ready = time.perf_counter() - start if wait_for(f"{base}/health/ready", {200}, deadline) else None
+        return first, ready
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+
+def summarize(name, samples):
+    samples = [s for s in samples if s is not None]
+    if not samples:
+        print(f"{name:<28} n/a")
+        return
+    print(f"{name:<28} median {statistics.median(samples) * 1000:8.1f} ms   "
+          f"min {min(samples) * 1000:8.1f} ms   max {max(samples) * 1000:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--timeout", type=float, default=60, help="seconds to wait per server run")
+    parser.add_argument("--no-warmup", action="store_true", help="start with WARMUP_ON_STARTUP=false")
+    args = parser.parse_args()
+
+    imports, firsts, readies = [], [], []
+    for _ in range(args.runs):
+        imports.append(measure_import())
+        first, ready = measure_server(args.port, not args.no_warmup, args.timeout)
+        firsts.append(first)
+        readies.append(ready)
+
+    print(f"runs={args.runs} warmup={'off' if args.no_warmup else 'on'}")
+    summarize("import main", imports)
+    summarize("first request served", firsts)
+    summarize("ready (/health/ready)", readies)
+
+
+if __name__ == "__main__":
+    main()
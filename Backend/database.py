@@ -1,11 +1,21 @@
 import mysql.connector
+import mysql.connector.pooling
 import os
+import threading
 from dotenv import load_dotenv
 import certifi
 
 load_dotenv()
 
-def get_db_conn():
+# Connections kept open between requests (0 = open a new one every time).
+# The pool is created on first use, or up front by the startup warm-up.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _db_config():
     # Get port with proper handling of empty strings
     db_port = os.getenv("DB_PORT", "4000")
     port = int(db_port) if db_port else 4000
@@ -29,8 +39,32 @@ def get_db_conn():
         config["ssl_verify_cert"] = True
         config["ssl_verify_identity"] = True
 
+    return config
+
+
+def init_db_pool():
+    """Open the pool's connections now instead of on the first request."""
+    global _pool
+    if DB_POOL_SIZE <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = mysql.connector.pooling.MySQLConnectionPool(
+                pool_name="persona_pool", pool_size=DB_POOL_SIZE, **_db_config()
+            )
+    return _pool
+
+
+def get_db_conn():
+    # conn.close() on a pooled connection hands it back to the pool
     try:
-        return mysql.connector.connect(**config)
+        pool = init_db_pool()
+        if pool is not None:
+            try:
+                return pool.get_connection()
+            except mysql.connector.errors.PoolError:
+                pass  # every pooled connection is busy - fall back to a fresh one
+        return mysql.connector.connect(**_db_config())
     except mysql.connector.Error as err:
         print(f"❌ Database Connection Error: {err}")
         raise err
@@ -0,0 +1,91 @@
+import asyncio
+import os
+import time
+import traceback
+from contextlib import asynccontextmanager
+
+from starlette.concurrency import run_in_threadpool
+
+from database import get_db_conn
+import metrics
+
+
+# ------------------ Config ------------------
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "true").lower() in ("1", "true", "yes")
+HEALTH_CHECK_INTERVAL = float(os.getenv("HEALTH_CHECK_INTERVAL", "15"))   # seconds between DB probes
+
+# Cached so health probes never touch the database themselves
+state = {
+    "started_at": time.time(),
+    "warmup": "pending",        # pending | running | done | failed | skipped
+    "warmup_seconds": None,
+    "db": {"ok": False, "checked_at": None, "error": None, "error_type": None, "traceback": None},
+}
+
+
+def is_ready():
+    return state["warmup"] not in ("pending", "running") and state["db"]["ok"]
+
+
+# ------------------ Checks ------------------
+def check_db():
+    try:
+        conn = get_db_conn()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+        finally:
+            cursor.close()
+            conn.close()
+        state["db"] = {"ok": True, "checked_at": time.time(), "error": None,
+                       "error_type": None, "traceback": None}
+    except Exception as e:
+        state["db"] = {"ok": False, "checked_at": time.time(), "error": str(e),
+                       "error_type": type(e).__name__, "traceback": traceback.format_exc()}
+    metrics.set_gauge("db_healthy", int(state["db"]["ok"]))
+
+
+def warm_up():
+    """Pre-open pooled DB connections, import the Gemini SDK and open its
+    gRPC channel so the first chat turn does not pay for that setup."""
+    state["warmup"] = "running"
+    start = time.monotonic()
+    try:
+        # Imported here: pulling in the model SDK is the slow part of startup.
+        # Inside the try so a broken import ends as "failed", not stuck "running"
+        from llm_client import DEFAULT_MODEL, get_model_client
+
+        check_db()   # first connection also opens the pool
+        get_model_client(DEFAULT_MODEL).warm_up()
+        state["warmup"] = "done" if state["db"]["ok"] else "failed"
+    except Exception as e:
+        print(f"❌ Warm-up Error: {e}")
+        traceback.print_exc()
+        state["warmup"] = "failed"
+    state["warmup_seconds"] = round(time.monotonic() - start, 3)
+    metrics.set_gauge("warmup_seconds", state["warmup_seconds"])
+
+
+# ------------------ Lifespan ------------------
+async def _startup():
+    if WARMUP_ON_STARTUP:
+        await run_in_threadpool(warm_up)
+    else:
+        state["warmup"] = "skipped"
+        await run_in_threadpool(check_db)
+
+    while True:
+        await asyncio.sleep(HEALTH_CHECK_INTERVAL)
+        await run_in_threadpool(check_db)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Warm-up runs in the background: the server accepts connections (and
+    # answers liveness) right away, readiness flips once warm-up finishes.
+    task = asyncio.ensure_future(_startup())
+    try:
+        yield
+    finally:
+        task.cancel()
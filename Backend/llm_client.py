@@ -0,0 +1,326 @@
+import math
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from functools import lru_cache
+
+from tenacity import (
+    Retrying,
+    retry_if_exception,
+    stop_after_attempt,
+    wait_random_exponential,
+)
+
+import metrics
+
+
+# ------------------ Config ------------------
+DEFAULT_MODEL = "gemini-2.0-flash"
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))                  # seconds per attempt
+LLM_MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "3"))
+LLM_RETRY_DEADLINE = float(os.getenv("LLM_RETRY_DEADLINE", "60"))    # seconds per call, all attempts
+LLM_MIN_ATTEMPT_TIMEOUT = float(os.getenv("LLM_MIN_ATTEMPT_TIMEOUT", "2"))  # don't retry with less time left
+LLM_RETRY_BUDGET_RATIO = float(os.getenv("LLM_RETRY_BUDGET_RATIO", "0.2"))
+LLM_RETRY_BUDGET_MAX = float(os.getenv("LLM_RETRY_BUDGET_MAX", "10"))
+
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_RESET = float(os.getenv("LLM_BREAKER_RESET", "30"))      # seconds open before a probe
+
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "false").lower() in ("1", "true", "yes")
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.5"))
+LLM_HEDGE_WORKERS = int(os.getenv("LLM_HEDGE_WORKERS", "16"))
+LLM_HEDGE_BUDGET_RATIO = float(os.getenv("LLM_HEDGE_BUDGET_RATIO", "0.1"))   # hedges per attempt, on average
+LLM_HEDGE_BUDGET_MAX = float(os.getenv("LLM_HEDGE_BUDGET_MAX", "5"))
+
+
+# ------------------ Lazy SDK ------------------
+# google.generativeai takes ~0.5s to import, so it is loaded on first use
+# (or by the startup warm-up) instead of when the app module is imported.
+_genai = None
+_genai_lock = threading.Lock()
+
+
+def load_genai():
+    global _genai
+    with _genai_lock:
+        if _genai is None:
+            import google.generativeai as genai
+            genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+            _genai = genai
+    return _genai
+
+
+@lru_cache(maxsize=None)
+def retryable_errors():
+    """Errors worth another attempt: throttling, 5xx and network/timeouts.
+    Anything else (bad request, auth, safety blocks) fails straight away."""
+    from google.api_core import exceptions as gexc
+    return (gexc.TooManyRequests, gexc.ServerError, TimeoutError, ConnectionError)
+
+
+@lru_cache(maxsize=None)
+def timeout_errors():
+    """SDK timeouts (request_options timeout) surface as DeadlineExceeded;
+    the hedge path raises the builtin TimeoutError."""
+    from google.api_core import exceptions as gexc
+    return (gexc.DeadlineExceeded, TimeoutError)
+
+
+class CircuitOpenError(Exception):
+    """Raised without calling the provider while the breaker is open."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"LLM provider unavailable, retry in {math.ceil(retry_after)}s")
+        self.retry_after = retry_after
+
+
+# ------------------ Retry Budget ------------------
+class RetryBudget:
+    """Token bucket: every call deposits `ratio` tokens, every retry spends one.
+
+    Keeps retries to roughly `ratio` of the traffic so a provider outage
+    does not turn into a retry storm.
+    """
+
+    def __init__(self, ratio=LLM_RETRY_BUDGET_RATIO, max_tokens=LLM_RETRY_BUDGET_MAX):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self):
+        with self._lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+# ------------------ Circuit Breaker ------------------
+class CircuitBreaker:
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name, failure_threshold=LLM_BREAKER_FAILURES, reset_timeout=LLM_BREAKER_RESET):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        metrics.set_gauge(f"llm_breaker_open:{name}", 0)
+
+    def _set_state(self, state):
+        if state != self.state:
+            self.state = state
+            metrics.incr(f"llm_breaker_transitions_total:{self.name}:{state}")
+            metrics.set_gauge(f"llm_breaker_open:{self.name}", int(state != self.CLOSED))
+
+    def allow(self):
+        """Raise CircuitOpenError unless a request may go to the provider."""
+        with self._lock:
+            if self.state == self.OPEN:
+                remaining = self.opened_at + self.reset_timeout - time.monotonic()
+                if remaining > 0:
+                    metrics.incr("llm_breaker_rejections_total")
+                    raise CircuitOpenError(remaining)
+                self._set_state(self.HALF_OPEN)
+
+            if self.state == self.HALF_OPEN:
+                # Only one probe at a time while we find out if the provider is back
+                if self._probing:
+                    metrics.incr("llm_breaker_rejections_total")
+                    raise CircuitOpenError(self.reset_timeout)
+                self._probing = True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._probing = False
+            self._set_state(self.CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self._set_state(self.OPEN)
+
+    def release(self):
+        """Attempt ended with a caller-side error; say nothing about provider health."""
+        with self._lock:
+            self._probing = False
+
+
+# ------------------ Resilient Client ------------------
+# Only hedge copies run here. A hedge takes a free slot or is skipped, so it
+# never sits in the pool queue while its deadline runs out.
+_hedge_pool = ThreadPoolExecutor(max_workers=LLM_HEDGE_WORKERS, thread_name_prefix="llm-hedge")
+_hedge_slots = threading.BoundedSemaphore(LLM_HEDGE_WORKERS)
+
+
+class ResilientModelClient:
+    """Drop-in for genai.GenerativeModel.generate_content with timeouts,
+    budgeted jittered retries, a circuit breaker and optional hedging."""
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+        self.model = load_genai().GenerativeModel(model_name)
+        self.breaker = CircuitBreaker(model_name)
+        self.budget = RetryBudget()
+        self.hedge_budget = RetryBudget(LLM_HEDGE_BUDGET_RATIO, LLM_HEDGE_BUDGET_MAX)
+        self.latency_metric = f"llm_latency_seconds:{model_name}"
+
+    def warm_up(self, timeout=LLM_TIMEOUT):
+        """Build the SDK's gRPC client and open its channel with a free
+        count_tokens call, so the first chat turn skips connection setup."""
+        self.model.count_tokens("warm-up", request_options={"timeout": timeout, "retry": None})
+
+    def generate_content(self, prompt, timeout=LLM_TIMEOUT):
+        metrics.incr("llm_calls_total")
+        self.budget.deposit()
+
+        # LLM_RETRY_DEADLINE caps the whole call: attempts get only the time
+        # that is left, and the backoff never sleeps into the last seconds
+        deadline = time.monotonic() + LLM_RETRY_DEADLINE
+        backoff = wait_random_exponential(multiplier=0.5, max=8)
+
+        def _remaining():
+            return deadline - time.monotonic()
+
+        def _deadline_stop(retry_state):
+            return _remaining() < LLM_MIN_ATTEMPT_TIMEOUT
+
+        def _capped_wait(retry_state):
+            return max(0, min(backoff(retry_state), _remaining() - LLM_MIN_ATTEMPT_TIMEOUT))
+
+        def _budget_stop(retry_state):
+            if self.budget.withdraw():
+                metrics.incr("llm_retries_total")
+                return False
+            metrics.incr("llm_retry_budget_exhausted_total")
+            return True
+
+        retrying = Retrying(
+            retry=retry_if_exception(lambda e: isinstance(e, retryable_errors())),
+            stop=stop_after_attempt(LLM_MAX_ATTEMPTS) | _deadline_stop | _budget_stop,
+            wait=_capped_wait,
+            reraise=True,
+        )
+        try:
+            return retrying(lambda: self._attempt(prompt, min(timeout, max(_remaining(), 0.001))))
+        except Exception:
+            metrics.incr("llm_call_failures_total")
+            raise
+
+    def _attempt(self, prompt, timeout):
+        self.breaker.allow()
+        start = time.monotonic()
+        delay = self._hedge_delay() if LLM_HEDGE_ENABLED else None
+        try:
+            if delay is not None and delay < timeout:
+                res = self._hedged_call(prompt, timeout, delay)
+            else:
+                res = self._call(prompt, timeout)
+        except Exception as e:
+            if not isinstance(e, retryable_errors()):
+                self.breaker.release()
+                raise
+            if isinstance(e, timeout_errors()):
+                metrics.incr("llm_timeouts_total")
+            metrics.incr("llm_attempt_errors_total")
+            self.breaker.record_failure()
+            raise
+
+        self.breaker.record_success()
+        metrics.observe(self.latency_metric, time.monotonic() - start)
+        return res
+
+    def _call(self, prompt, timeout):
+        return self.model.generate_content(prompt, request_options={"timeout": timeout})
+
+    def _hedge_delay(self):
+        if metrics.sample_count(self.latency_metric) < LLM_HEDGE_MIN_SAMPLES:
+            return None
+        return max(LLM_HEDGE_MIN_DELAY, metrics.percentile(self.latency_metric, 95))
+
+    def _hedged_call(self, prompt, timeout, delay):
+        start = time.monotonic()
+        self.hedge_budget.deposit()
+
+        # The caller must stay free to take whichever copy answers first, so
+        # the primary gets its own thread; it starts at once and is never queued
+        primary = Future()
+
+        def run_primary():
+            try:
+                primary.set_result(self._call(prompt, timeout))
+            except Exception as e:
+                primary.set_exception(e)
+
+        threading.Thread(target=run_primary, name="llm-primary", daemon=True).start()
+        futures = {primary}
+
+        done, _ = wait(futures, timeout=delay)
+        if not done:
+            hedge = self._start_hedge(prompt, timeout - delay)
+            if hedge is not None:
+                futures.add(hedge)
+
+        # First success wins; an error only counts once every copy has failed.
+        # Both copies carry SDK timeouts ending at the deadline, so a loser
+        # stops by then instead of holding its thread.
+        deadline = start + timeout
+        error = None
+        while futures:
+            done, futures = wait(futures, timeout=max(0, deadline - time.monotonic()),
+                                 return_when=FIRST_COMPLETED)
+            if not done:
+                raise TimeoutError(f"LLM call exceeded {timeout}s")
+            for f in done:
+                if f.exception() is None:
+                    if f is not primary:
+                        metrics.incr("llm_hedge_wins_total")
+                    return f.result()
+                error = f.exception()
+        raise error
+
+    def _start_hedge(self, prompt, timeout):
+        """Send a duplicate request, unless the provider is struggling, the
+        hedge pool is full or the hedge budget is spent."""
+        if self.breaker.state != CircuitBreaker.CLOSED:
+            metrics.incr("llm_hedges_skipped_total:breaker")
+            return None
+        if not _hedge_slots.acquire(blocking=False):
+            metrics.incr("llm_hedges_skipped_total:saturated")
+            return None
+        if not self.hedge_budget.withdraw():
+            _hedge_slots.release()
+            metrics.incr("llm_hedges_skipped_total:budget")
+            return None
+
+        metrics.incr("llm_hedges_total")
+        hedge = _hedge_pool.submit(self._call, prompt, timeout)
+        hedge.add_done_callback(lambda _: _hedge_slots.release())
+        return hedge
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_model_client(model_name):
+    """Return the process-wide client for a model so breaker state,
+    retry budget and latency history are shared by every pipeline."""
+    with _clients_lock:
+        if model_name not in _clients:
+            _clients[model_name] = ResilientModelClient(model_name)
+        return _clients[model_name]
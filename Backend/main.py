@@ -1,12 +1,22 @@
-from fastapi import FastAPI, HTTPException, Body
+import asyncio
+import threading
+import time
+from fastapi import FastAPI, HTTPException, Body, Request, Response, WebSocket
+from starlette.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from datetime import datetime
 from database import get_db_conn
 from schemas import UserCreate, UserLogin, PersonaCreate, PersonaOut, MessageCreate
 from utils import hash_password, verify_password
-from agents import MultiAgentPipeline, save_message_api
+from agents import MultiAgentPipeline, PipelineCancelled, fetch_persona_api, save_message_api
+from admission import chat_admission, AdmissionRejected
+from llm_client import CircuitOpenError
+from ws_chat import chat_socket
+import lifecycle
+import metrics
 
-app = FastAPI(title="Persona AI – Final Backend")
+app = FastAPI(title="Persona AI – Final Backend", lifespan=lifecycle.lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -21,26 +31,43 @@ def root():
     return {"msg": "Persona AI Backend Running..."}
 
 @app.get("/health")
-def health_check():
-    """Test database connection"""
-    try:
-        conn = get_db_conn()
-        cursor = conn.cursor()
-        cursor.execute("SELECT 1")
-        result = cursor.fetchone()
-        cursor.close()
-        conn.close()
-        return {"status": "healthy", "database": "connected", "test_query": result[0]}
-    except Exception as e:
-        import traceback
-        error_details = traceback.format_exc()
-        return {
-            "status": "unhealthy",
-            "database": "disconnected",
-            "error": str(e),
-            "error_type": type(e).__name__,
-            "traceback": error_details
-        }
+async def health_check():
+    """Database status from the last background check (no query per probe)"""
+    db = lifecycle.state["db"]
+    if db["ok"]:
+        return {"status": "healthy", "database": "connected", "checked_at": db["checked_at"]}
+    return {
+        "status": "unhealthy",
+        "database": "disconnected",
+        "checked_at": db["checked_at"],
+        "error": db["error"],
+        "error_type": db["error_type"],
+        "traceback": db["traceback"]
+    }
+
+
+@app.get("/health/live")
+async def liveness():
+    """Process is up and serving requests"""
+    return {"status": "alive", "uptime": round(time.time() - lifecycle.state["started_at"], 1)}
+
+
+@app.get("/health/ready")
+async def readiness():
+    """Warm-up finished and the last database check passed"""
+    body = {
+        "ready": lifecycle.is_ready(),
+        "warmup": lifecycle.state["warmup"],
+        "warmup_seconds": lifecycle.state["warmup_seconds"],
+        "database": "connected" if lifecycle.state["db"]["ok"] else "disconnected",
+    }
+    return JSONResponse(body, status_code=200 if body["ready"] else 503)
+
+
+@app.get("/metrics")
+def get_metrics():
+    """In-process counters, gauges and latency percentiles"""
+    return metrics.snapshot()
 
 
 # --------------------------------------------------------
@@ -48,12 +75,13 @@ def health_check():
 # --------------------------------------------------------
 @app.post("/register")
 def register(user: UserCreate):
-    conn = get_db_conn()
-    cursor = conn.cursor()
-
+    # Hash before taking a pooled connection; bcrypt is deliberately slow
     hashed = hash_password(user.password)
     now = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
 
+    conn = get_db_conn()
+    cursor = conn.cursor()
+
     print(f"DEBUG: Registering user: '{user.username}'")
 
 
@@ -90,11 +118,12 @@ def login(data: UserLogin):
     conn = get_db_conn()
     cursor = conn.cursor(dictionary=True)
 
-    cursor.execute("SELECT * FROM users WHERE username=%s", (data.username,))
-    user = cursor.fetchone()
-
-    cursor.close()
-    conn.close()
+    try:
+        cursor.execute("SELECT * FROM users WHERE username=%s", (data.username,))
+        user = cursor.fetchone()
+    finally:
+        cursor.close()
+        conn.close()
 
     if not user or not verify_password(data.password, user["hashed_password"]):
         raise HTTPException(status_code=401, detail="Invalid username/password")
@@ -112,9 +141,6 @@ def login(data: UserLogin):
 @app.post("/personas", response_model=PersonaOut)
 def create_persona(p: PersonaCreate):
 
-    conn = get_db_conn()
-    cursor = conn.cursor()
-
     # Fix defaults
     tone = p.tone if p.tone else "neutral"
     summary = p.summary if p.summary else ""
@@ -124,19 +150,23 @@ def create_persona(p: PersonaCreate):
 
     now = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
 
-    cursor.execute("""
-        INSERT INTO persona_flow (user_id, character_name, mode, tone, summary, created_at)
-        VALUES (%s, %s, %s, %s, %s, %s)
-    """, (p.user_id, p.character_name, p.mode, tone, summary, now))
+    conn = get_db_conn()
+    cursor = conn.cursor()
 
-    conn.commit()
-    persona_id = cursor.lastrowid
+    try:
+        cursor.execute("""
+            INSERT INTO persona_flow (user_id, character_name, mode, tone, summary, created_at)
+            VALUES (%s, %s, %s, %s, %s, %s)
+        """, (p.user_id, p.character_name, p.mode, tone, summary, now))
 
-    cursor.execute("SELECT * FROM persona_flow WHERE id=%s", (persona_id,))
-    row = cursor.fetchone()
+        conn.commit()
+        persona_id = cursor.lastrowid
 
-    cursor.close()
-    conn.close()
+        cursor.execute("SELECT * FROM persona_flow WHERE id=%s", (persona_id,))
+        row = cursor.fetchone()
+    finally:
+        cursor.close()
+        conn.close()
 
     return PersonaOut(
         id=row[0], user_id=row[1], character_name=row[2],
@@ -147,35 +177,29 @@ def create_persona(p: PersonaCreate):
 # --------------------------------------------------------
 # CHAT WITH AGENT
 # --------------------------------------------------------
-@app.post("/agent/respond")
-def agent_respond(
-    user_id: int = Body(...),
-    persona_id: int = Body(...),
-    user_input: str = Body(...)
-):
+# How often a running turn checks whether its client is still connected
+DISCONNECT_POLL = 0.5
 
-    # Check persona belongs to user
-    conn = get_db_conn()
-    cursor = conn.cursor(dictionary=True)
 
-    cursor.execute("SELECT * FROM persona_flow WHERE id=%s AND user_id=%s",
-                   (persona_id, user_id))
-    persona = cursor.fetchone()
+# Nobody is left to read the reply (499 = client closed request)
+CLIENT_CLOSED_REQUEST = 499
 
-    if not persona:
-        raise HTTPException(404, "Persona not found for this user")
-
-    cursor.close()
-    conn.close()
 
+def _agent_turn(persona, persona_id, user_input, cancel_event):
     pipeline = MultiAgentPipeline(persona["character_name"], persona["tone"] or "neutral")
 
     save_message_api(persona_id, "user", user_input)
     
     try:
-        reply = pipeline.run(persona_id, user_input)
+        reply = pipeline.run(persona_id, user_input, cancel_event)
         save_message_api(persona_id, "agent", reply)
         return {"reply": reply}
+    except PipelineCancelled:
+        raise
+    except CircuitOpenError as e:
+        # Provider is degraded - fail fast and tell the client when to come back
+        raise HTTPException(status_code=503, detail=str(e),
+                            headers={"Retry-After": str(int(e.retry_after) + 1)})
     except Exception as e:
         print(f"❌ Agent Error: {e}")
         import traceback
@@ -183,6 +207,62 @@ def agent_respond(
         raise HTTPException(status_code=500, detail=f"Agent Error: {str(e)}")
 
 
+@app.post("/agent/respond")
+async def agent_respond(
+    request: Request,
+    user_id: int = Body(...),
+    persona_id: int = Body(...),
+    user_input: str = Body(...)
+):
+    try:
+        async with chat_admission.admit(user_id):
+            # Clients that gave up while queued get no work done for them
+            if await request.is_disconnected():
+                metrics.incr("agent_turns_cancelled_total")
+                return Response(status_code=CLIENT_CLOSED_REQUEST)
+
+            # Check persona belongs to user
+            persona = await run_in_threadpool(fetch_persona_api, persona_id, user_id)
+
+            if not persona:
+                raise HTTPException(404, "Persona not found for this user")
+
+            # Last check before the user message is stored and Gemini is called
+            if await request.is_disconnected():
+                metrics.incr("agent_turns_cancelled_total")
+                return Response(status_code=CLIENT_CLOSED_REQUEST)
+
+            cancel_event = threading.Event()
+            task = asyncio.ensure_future(
+                run_in_threadpool(_agent_turn, persona, persona_id, user_input, cancel_event)
+            )
+
+            # Stop the pipeline at its next step if the client hangs up
+            while not task.done():
+                await asyncio.wait({task}, timeout=DISCONNECT_POLL)
+                if not task.done() and await request.is_disconnected():
+                    cancel_event.set()
+                    metrics.incr("agent_turns_cancelled_total")
+                    break
+
+            try:
+                return await task
+            except PipelineCancelled:
+                return Response(status_code=CLIENT_CLOSED_REQUEST)
+
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail,
+                            headers={"Retry-After": str(e.retry_after)})
+
+
+# --------------------------------------------------------
+# CHAT OVER WEBSOCKET (one connection per persona session)
+# --------------------------------------------------------
+@app.websocket("/ws/chat/{persona_id}")
+async def chat_websocket(websocket: WebSocket, persona_id: int, user_id: int):
+    await chat_socket(websocket, persona_id, user_id)
+
+
 # --------------------------------------------------------
 # GET MESSAGES FOR ONE CHARACTER
 # --------------------------------------------------------
@@ -192,22 +272,23 @@ def get_messages(persona_id: int, user_id: int):
     conn = get_db_conn()
     cursor = conn.cursor(dictionary=True)
 
-    cursor.execute("SELECT * FROM persona_flow WHERE id=%s AND user_id=%s",
-                   (persona_id, user_id))
-    owner = cursor.fetchone()
-
-    if not owner:
-        raise HTTPException(403, "Access denied")
+    try:
+        cursor.execute("SELECT * FROM persona_flow WHERE id=%s AND user_id=%s",
+                       (persona_id, user_id))
+        owner = cursor.fetchone()
 
-    cursor.execute("""
-        SELECT * FROM persona_messages
-        WHERE persona_id=%s ORDER BY id ASC
-    """, (persona_id,))
+        if not owner:
+            raise HTTPException(403, "Access denied")
 
-    rows = cursor.fetchall()
+        cursor.execute("""
+            SELECT * FROM persona_messages
+            WHERE persona_id=%s ORDER BY id ASC
+        """, (persona_id,))
 
-    cursor.close()
-    conn.close()
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+        conn.close()
 
     return rows
 
@@ -216,19 +297,21 @@ def get_messages(persona_id: int, user_id: int):
 # GET FULL MESSAGE HISTORY
 # --------------------------------------------------------
 @app.get("/messages/full/{persona_id}")
-def full_history(persona_id: int):
+def full_history(persona_id: int, after_id: int = 0):
+    # after_id lets clients fetch only messages newer than the last one they have
     conn = get_db_conn()
     cursor = conn.cursor(dictionary=True)
 
-    cursor.execute("""
-        SELECT * FROM persona_messages
-        WHERE persona_id=%s ORDER BY created_at ASC
-    """, (persona_id,))
-
-    rows = cursor.fetchall()
+    try:
+        cursor.execute("""
+            SELECT * FROM persona_messages
+            WHERE persona_id=%s AND id > %s ORDER BY created_at ASC, id ASC
+        """, (persona_id, after_id))
 
-    cursor.close()
-    conn.close()
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+        conn.close()
 
     return rows
 
@@ -241,19 +324,20 @@ def list_personas(user_id: int):
     conn = get_db_conn()
     cursor = conn.cursor(dictionary=True)
 
-    cursor.execute("""
-        SELECT pf.*,
-        (SELECT COUNT(*) FROM persona_messages pm WHERE pm.persona_id = pf.id)
-        AS message_count
-        FROM persona_flow pf
-        WHERE user_id = %s
-        ORDER BY created_at DESC
-    """, (user_id,))
-
-    personas = cursor.fetchall()
-
-    cursor.close()
-    conn.close()
+    try:
+        cursor.execute("""
+            SELECT pf.*,
+            (SELECT COUNT(*) FROM persona_messages pm WHERE pm.persona_id = pf.id)
+            AS message_count
+            FROM persona_flow pf
+            WHERE user_id = %s
+            ORDER BY created_at DESC
+        """, (user_id,))
+
+        personas = cursor.fetchall()
+    finally:
+        cursor.close()
+        conn.close()
 
     return personas
 
@@ -266,18 +350,20 @@ def delete_persona(persona_id: int, user_id: int):
     conn = get_db_conn()
     cursor = conn.cursor(dictionary=True)
 
-    cursor.execute("SELECT * FROM persona_flow WHERE id=%s AND user_id=%s",
-                   (persona_id, user_id))
-    persona = cursor.fetchone()
+    try:
+        cursor.execute("SELECT * FROM persona_flow WHERE id=%s AND user_id=%s",
+                       (persona_id, user_id))
+        persona = cursor.fetchone()
 
-    if not persona:
-        raise HTTPException(403, "Persona not found or not owned by user")
+        if not persona:
+            raise HTTPException(403, "Persona not found or not owned by user")
 
-    cursor.execute("DELETE FROM persona_messages WHERE persona_id=%s", (persona_id,))
-    cursor.execute("DELETE FROM persona_flow WHERE id=%s", (persona_id,))
+        cursor.execute("DELETE FROM persona_messages WHERE persona_id=%s", (persona_id,))
+        cursor.execute("DELETE FROM persona_flow WHERE id=%s", (persona_id,))
 
-    conn.commit()
-    cursor.close()
-    conn.close()
+        conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
 
     return {"msg": "Persona deleted", "id": persona_id}
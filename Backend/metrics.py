@@ -0,0 +1,59 @@
+import threading
+from collections import defaultdict, deque
+
+
+# ------------------ In-process metrics ------------------
+# Tiny thread-safe registry shared by the backend modules and exposed
+# as JSON on GET /metrics. Counters only go up, gauges are set to the
+# current value, and latencies keep a rolling window for percentiles.
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_gauges = {}
+_latencies = defaultdict(lambda: deque(maxlen=500))
+
+
+def incr(name, value=1):
+    with _lock:
+        _counters[name] += value
+
+
+def set_gauge(name, value):
+    with _lock:
+        _gauges[name] = value
+
+
+def observe(name, seconds):
+    with _lock:
+        _latencies[name].append(seconds)
+
+
+def percentile(name, pct):
+    with _lock:
+        samples = sorted(_latencies[name])
+    if not samples:
+        return None
+    idx = min(len(samples) - 1, int(round(pct / 100 * (len(samples) - 1))))
+    return samples[idx]
+
+
+def sample_count(name):
+    with _lock:
+        return len(_latencies[name])
+
+
+def snapshot():
+    with _lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+        names = list(_latencies)
+
+    latencies = {}
+    for name in names:
+        latencies[name] = {
+            "count": sample_count(name),
+            "p50": percentile(name, 50),
+            "p95": percentile(name, 95),
+            "p99": percentile(name, 99),
+        }
+
+    return {"counters": counters, "gauges": gauges, "latencies": latencies}
@@ -0,0 +1,213 @@
+import asyncio
+import os
+import threading
+from collections import deque
+
+from starlette.concurrency import run_in_threadpool
+from starlette.websockets import WebSocketDisconnect, WebSocketState
+
+from agents import (
+    MultiAgentPipeline,
+    PipelineCancelled,
+    fetch_last_messages_api,
+    fetch_persona_api,
+    save_message_api,
+)
+from admission import chat_admission, AdmissionRejected
+from llm_client import CircuitOpenError, timeout_errors
+import metrics
+
+
+# ------------------ Config ------------------
+WS_IDLE_TIMEOUT = float(os.getenv("WS_IDLE_TIMEOUT", "300"))   # seconds without messages before closing
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "10"))    # slow readers get disconnected
+WS_MAX_PENDING = int(os.getenv("WS_MAX_PENDING", "2"))         # messages queued behind the running turn
+WS_HISTORY_LIMIT = 10                                          # same window the HTTP pipeline reads
+
+_active = 0
+
+
+class SlowConsumer(Exception):
+    """A send to the client did not finish within WS_SEND_TIMEOUT."""
+
+
+# ------------------ Chat Session ------------------
+class ChatSession:
+    """One websocket connection to one persona.
+
+    The persona, its pipeline and the recent history are loaded once and
+    kept in memory, so a turn costs two inserts plus the model calls.
+    Messages are answered one at a time by a worker; the reader only
+    queues them, rejecting new ones when WS_MAX_PENDING are waiting.
+
+    Protocol (JSON both ways):
+        client -> {"message": "..."}
+        server -> {"type": "ready", "persona": {...}, "history": [...]}
+                  {"type": "typing"}
+                  {"type": "reply", "id": ..., "user_message_id": ..., "message": "..."}
+                  {"type": "error", "code": 400|429|500|503|504, "detail": "...", "retry_after": ...}
+    """
+
+    def __init__(self, websocket, persona, user_id):
+        self.ws = websocket
+        self.persona = persona
+        self.user_id = user_id
+        self.pipeline = MultiAgentPipeline(persona["character_name"], persona["tone"] or "neutral")
+        self.history = deque(maxlen=WS_HISTORY_LIMIT)
+        self.inbox = asyncio.Queue(maxsize=WS_MAX_PENDING)
+        self.busy = False
+        self.cancel_event = threading.Event()
+        self._send_lock = asyncio.Lock()
+
+    async def send(self, payload):
+        async with self._send_lock:
+            try:
+                await asyncio.wait_for(self.ws.send_json(payload), WS_SEND_TIMEOUT)
+            except asyncio.TimeoutError:
+                # Raised as its own type: on 3.11 asyncio.TimeoutError is the
+                # builtin TimeoutError that model timeouts use as well
+                metrics.incr("ws_slow_consumer_closed_total")
+                raise SlowConsumer()
+
+    async def send_error(self, code, detail, retry_after=None):
+        await self.send({"type": "error", "code": code, "detail": detail, "retry_after": retry_after})
+
+    async def reader(self):
+        while True:
+            try:
+                data = await asyncio.wait_for(self.ws.receive_json(), WS_IDLE_TIMEOUT)
+            except asyncio.TimeoutError:
+                if self.busy or not self.inbox.empty():
+                    continue
+                metrics.incr("ws_idle_closed_total")
+                return
+            except (ValueError, KeyError):
+                # not JSON, or a binary frame
+                await self.send_error(400, "Expected JSON like {\"message\": \"...\"}")
+                continue
+
+            text = data.get("message") if isinstance(data, dict) else None
+            if not isinstance(text, str) or not text.strip():
+                await self.send_error(400, "message is required")
+                continue
+
+            try:
+                self.inbox.put_nowait(text)
+            except asyncio.QueueFull:
+                metrics.incr("ws_backpressure_rejected_total")
+                await self.send_error(429, "Previous messages are still being answered", 1)
+
+    async def worker(self):
+        while not self.cancel_event.is_set():
+            text = await self.inbox.get()
+            self.busy = True
+            try:
+                await self.handle(text)
+            finally:
+                self.busy = False
+
+    async def handle(self, text):
+        metrics.incr("ws_messages_total")
+        try:
+            async with chat_admission.admit(self.user_id):
+                await self.send({"type": "typing"})
+                user_message_id, reply_id, reply = await run_in_threadpool(self._turn, text)
+        except PipelineCancelled:
+            return
+        except AdmissionRejected as e:
+            await self.send_error(e.status_code, e.detail, e.retry_after)
+        except CircuitOpenError as e:
+            await self.send_error(503, str(e), int(e.retry_after) + 1)
+        except (WebSocketDisconnect, SlowConsumer):
+            raise
+        except timeout_errors() as e:
+            await self.send_error(504, f"Agent timed out: {str(e)}")
+        except Exception as e:
+            print(f"❌ Agent Error: {e}")
+            import traceback
+            traceback.print_exc()
+            await self.send_error(500, f"Agent Error: {str(e)}")
+        else:
+            await self.send({
+                "type": "reply",
+                "id": reply_id,
+                "user_message_id": user_message_id,
+                "message": reply,
+            })
+
+    def _turn(self, text):
+        # Runs in the threadpool; the worker never runs two turns at once
+        persona_id = self.persona["id"]
+        user_message_id = save_message_api(persona_id, "user", text)
+        self.history.append({"sender": "user", "message": text})
+
+        reply = self.pipeline.run(persona_id, text, self.cancel_event, history=list(self.history))
+
+        reply_id = save_message_api(persona_id, "agent", reply)
+        self.history.append({"sender": "agent", "message": reply})
+        return user_message_id, reply_id, reply
+
+    async def run(self):
+        reader = asyncio.ensure_future(self.reader())
+        worker = asyncio.ensure_future(self.worker())
+        await asyncio.wait({reader, worker}, return_when=asyncio.FIRST_COMPLETED)
+
+        # Stop the running turn at its next step; let it finish so the
+        # admission slot is only released once the work has really stopped
+        self.cancel_event.set()
+        reader.cancel()
+        if not self.busy:
+            worker.cancel()
+        results = await asyncio.gather(reader, worker, return_exceptions=True)
+
+        # Hand unexpected failures to chat_socket so it closes with 1011
+        for result in results:
+            if isinstance(result, Exception) and not isinstance(result, (WebSocketDisconnect, SlowConsumer)):
+                raise result
+
+
+async def chat_socket(websocket, persona_id, user_id):
+    global _active
+
+    # Authenticate once for the whole connection
+    persona = await run_in_threadpool(fetch_persona_api, persona_id, user_id)
+    if not persona:
+        await websocket.close(code=1008, reason="Persona not found for this user")
+        return
+
+    await websocket.accept()
+    _active += 1
+    metrics.set_gauge("ws_connections", _active)
+    metrics.incr("ws_connections_total")
+
+    session = ChatSession(websocket, persona, user_id)
+    close_code = 1000
+    try:
+        session.history.extend(await run_in_threadpool(fetch_last_messages_api, persona_id, WS_HISTORY_LIMIT))
+        await session.send({
+            "type": "ready",
+            "persona": {
+                "id": persona["id"],
+                "character_name": persona["character_name"],
+                "mode": persona["mode"],
+                "tone": persona["tone"],
+            },
+            "history": list(session.history),
+        })
+        await session.run()
+    except (WebSocketDisconnect, SlowConsumer):
+        pass
+    except Exception as e:
+        print(f"❌ WebSocket Error: {e}")
+        import traceback
+        traceback.print_exc()
+        close_code = 1011   # internal error
+    finally:
+        session.cancel_event.set()
+        _active -= 1
+        metrics.set_gauge("ws_connections", _active)
+        if websocket.client_state == WebSocketState.CONNECTED:
+            try:
+                await websocket.close(code=close_code)
+            except Exception:
+                pass
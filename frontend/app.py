@@ -1,6 +1,7 @@
 import streamlit as st
 import requests
-import time
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from datetime import datetime
 import os
 
@@ -26,6 +27,10 @@ if "persona_id" not in st.session_state:
     st.session_state.persona_id = None
 if "personas" not in st.session_state:
     st.session_state.personas = []
+if "personas_stale" not in st.session_state:
+    st.session_state.personas_stale = True   # refetch persona list on next use
+if "messages" not in st.session_state:
+    st.session_state.messages = {}           # persona_id -> cached history
 if "persona_name" not in st.session_state:
     st.session_state.persona_name = None
 if "menu" not in st.session_state:
@@ -33,9 +38,28 @@ if "menu" not in st.session_state:
 
 
 # ---------------------- API HELPERS ----------------------
-def api_post(path, json=None, params=None):
+@st.cache_resource
+def get_http_session():
+    """One keep-alive connection pool shared by every rerun and browser session."""
+    session = requests.Session()
+    # Connection errors are retried for every method (nothing reached the server);
+    # 5xx only for idempotent calls so a chat message is never sent twice.
+    retries = Retry(
+        total=3,
+        backoff_factor=0.3,
+        status_forcelist=[502, 503, 504],
+        allowed_methods=["GET", "DELETE"],
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retries)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def api_post(path, json=None, params=None, timeout=30):
     try:
-        return requests.post(f"{BASE_URL}{path}", json=json, params=params, timeout=30)
+        return get_http_session().post(f"{BASE_URL}{path}", json=json, params=params, timeout=timeout)
     except Exception as e:
         st.error(f"Network Error: {e}")
         return None
@@ -43,7 +67,7 @@ def api_post(path, json=None, params=None):
 
 def api_get(path, params=None):
     try:
-        return requests.get(f"{BASE_URL}{path}", params=params, timeout=30)
+        return get_http_session().get(f"{BASE_URL}{path}", params=params, timeout=30)
     except Exception as e:
         st.error(f"Network Error: {e}")
         return None
@@ -51,7 +75,7 @@ def api_get(path, params=None):
 
 def api_delete(path, params=None):
     try:
-        return requests.delete(f"{BASE_URL}{path}", params=params, timeout=30)
+        return get_http_session().delete(f"{BASE_URL}{path}", params=params, timeout=30)
     except Exception as e:
         st.error(f"Network Error: {e}")
         return None
@@ -100,12 +124,42 @@ def login_ui():
 def load_personas():
     if not st.session_state.user_id:
         return []
+    if not st.session_state.personas_stale:
+        return st.session_state.personas
     r = api_get(f"/personas/list/{st.session_state.user_id}")
     if r and r.status_code == 200:
         st.session_state.personas = r.json()
+        st.session_state.personas_stale = False
     return st.session_state.personas
 
 
+def invalidate_personas():
+    st.session_state.personas_stale = True
+
+
+# ---------------------- MESSAGE CACHE ----------------------
+def load_messages(persona_id):
+    """Cached history for a persona; only the first visit fetches it in full."""
+    if persona_id not in st.session_state.messages:
+        r = api_get(f"/messages/full/{persona_id}")
+        if not (r and r.status_code == 200):
+            return []
+        st.session_state.messages[persona_id] = r.json()
+    return st.session_state.messages[persona_id]
+
+
+def refresh_messages(persona_id):
+    """Append messages newer than the last cached one."""
+    cached = st.session_state.messages.get(persona_id)
+    if cached is None:
+        return load_messages(persona_id)
+    last_id = max((m["id"] for m in cached), default=0)
+    r = api_get(f"/messages/full/{persona_id}", params={"after_id": last_id})
+    if r and r.status_code == 200:
+        cached.extend(r.json())
+    return cached
+
+
 def go_to_chat(p_id, p_name):
     st.session_state.persona_id = p_id
     st.session_state.persona_name = p_name
@@ -137,6 +191,7 @@ def handle_create_persona():
     r = api_post("/personas", json=payload)
     if r and r.status_code == 200:
         new_p = r.json()
+        invalidate_personas()
         # Success - navigate to chat
         st.session_state.persona_id = new_p["id"]
         st.session_state.persona_name = new_p["character_name"]
@@ -171,6 +226,8 @@ def delete_persona(persona_id):
 
     if r and r.status_code == 200:
         st.success("Persona deleted successfully")
+        invalidate_personas()
+        st.session_state.messages.pop(persona_id, None)
         if st.session_state.persona_id == persona_id:
             st.session_state.persona_id = None
         st.rerun()
@@ -184,9 +241,7 @@ def chat_ui(persona):
 
     persona_id = persona["id"]
 
-    # Fetch full history
-    r = api_get(f"/messages/full/{persona_id}")
-    messages = r.json() if (r and r.status_code == 200) else []
+    messages = load_messages(persona_id)
 
     # Display messages
     for m in messages:
@@ -210,12 +265,25 @@ def chat_ui(persona):
             "user_input": user_msg
         }
 
-        # Send to backend
-        api_post("/agent/respond", json=payload)
+        # Send to backend (agent turns can take a while)
+        r = api_post("/agent/respond", json=payload, timeout=120)
 
-        # Wait a moment, then refresh history
-        time.sleep(0.2)
-        st.rerun()
+        # Pull only what this turn added (user message + reply)
+        refresh_messages(persona_id)
+        invalidate_personas()   # message counts changed
+
+        if r is not None and r.status_code == 200:
+            st.rerun()
+        elif r is not None and r.status_code in (429, 503):
+            wait = r.headers.get("Retry-After", "a few")
+            try:
+                detail = r.json().get("detail", "Server busy")
+            except ValueError:
+                # e.g. an HTML error page from a proxy / Hugging Face Spaces
+                detail = "Server busy"
+            st.warning(f"{detail} – try again in {wait}s")
+        elif r is not None:
+            st.error(r.text)
 
 
 # ---------------------- MAIN PAGE ----------------------
@@ -274,13 +342,12 @@ def main():
         if not st.session_state.persona_id:
             st.info("Select a persona from the Dashboard first.")
         else:
-            personas = load_personas()
-            persona = next((x for x in personas if x["id"] == st.session_state.persona_id), None)
-
-            if persona:
-                chat_ui(persona)
-            else:
-                st.error("Persona not found.")
+            # Name was stored when the persona was picked; no need to list them all
+            persona = {
+                "id": st.session_state.persona_id,
+                "character_name": st.session_state.persona_name,
+            }
+            chat_ui(persona)
 
 
 if __name__ == "__main__":